@@ -1,48 +1,97 @@
 #!/usr/bin/env python3
-from collections import defaultdict
+from collections import Counter, defaultdict
+from dataclasses import dataclass
 from pathlib import Path
 
+import functools
 import hashlib
-import json
 import logging
+import orjson
 import os
 import prometheus_client
+import select
+import shutil
 import subprocess
 import tarfile
 import time
-import urllib.request, urllib.error
+import urllib3
 
 log = logging.getLogger('nftables-exporter')
 
-try:
-    logging.basicConfig(level=os.environ.get('NFTABLES_EXPORTER_LOG_LEVEL', 'INFO').upper())
-    ADDRESS = os.environ.get('NFTABLES_EXPORTER_ADDRESS', '')
-    PORT = int(os.environ.get('NFTABLES_EXPORTER_PORT', 9630))
-    UPDATE_PERIOD = int(os.environ.get('NFTABLES_EXPORTER_UPDATE_PERIOD', 60))
-    NAMESPACE = os.environ.get('NFTABLES_EXPORTER_NAMESPACE', 'nftables')
-    MAXMIND_LICENSE_KEY = os.environ.get('MAXMIND_LICENSE_KEY')
-    MAXMIND_DATABASE_EDITION = os.environ.get('MAXMIND_DATABASE_EDITION', 'GeoLite2-Country')
-    MAXMIND_CACHE_DIRECTORY = Path(os.environ.get('MAXMIND_CACHE_DIRECTORY', './data/')).expanduser()
-except Exception as e:
-    raise RuntimeError('one or more environment variables are invalid') from e
-
-if MAXMIND_LICENSE_KEY and MAXMIND_DATABASE_EDITION:
+
+def parse_log_level(value):
+    """Returns the normalized name of a log level from pythons logging module."""
+    level = value.upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f'unknown log level {value}')
+    return level
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Settings of the exporter, see README.md for their environment variables."""
+    log_level: str = 'INFO'
+    address: str = ''
+    port: int = 9630
+    update_period: int = 60
+    namespace: str = 'nftables'
+    maxmind_license_key: str | None = None
+    maxmind_database_edition: str = 'GeoLite2-Country'
+    maxmind_cache_directory: Path = Path('./data/')
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """Reads the settings from environment variables and falls back to defaults for unset ones."""
+        variables = (
+            ('log_level', 'NFTABLES_EXPORTER_LOG_LEVEL', parse_log_level),
+            ('address', 'NFTABLES_EXPORTER_ADDRESS', str),
+            ('port', 'NFTABLES_EXPORTER_PORT', int),
+            ('update_period', 'NFTABLES_EXPORTER_UPDATE_PERIOD', int),
+            ('namespace', 'NFTABLES_EXPORTER_NAMESPACE', str),
+            ('maxmind_license_key', 'MAXMIND_LICENSE_KEY', str),
+            ('maxmind_database_edition', 'MAXMIND_DATABASE_EDITION', str),
+            ('maxmind_cache_directory', 'MAXMIND_CACHE_DIRECTORY', lambda value: Path(value).expanduser()),
+        )
+        settings = {}
+        for field, variable, parse in variables:
+            if variable in environ:
+                try:
+                    settings[field] = parse(environ[variable])
+                except ValueError as e:
+                    raise RuntimeError(f'environment variable {variable} is invalid') from e
+        return cls(**settings)
+
+    @property
+    def geoip_enabled(self):
+        return bool(self.maxmind_license_key and self.maxmind_database_edition)
+
+
+CONFIG = Config.from_env()
+logging.basicConfig(level=CONFIG.log_level)
+
+if CONFIG.geoip_enabled:
     import maxminddb
 
+try:
+    import nftables as libnftables
+except ImportError:
+    libnftables = None
+
 
 def main():
     """The main entry point."""
     metrics = get_prometheus_metrics()
-    prometheus_client.start_http_server(addr=ADDRESS, port=PORT)
-    log.info(f'listing on {ADDRESS}:{PORT}')
-    if MAXMIND_LICENSE_KEY and MAXMIND_DATABASE_EDITION:
+    nftables = open_nftables()
+    prometheus_client.start_http_server(addr=CONFIG.address, port=CONFIG.port)
+    log.info(f'listing on {CONFIG.address}:{CONFIG.port}')
+    if CONFIG.geoip_enabled:
         log.info('geoip lookup enabled')
-        database_path = prepare_maxmind_database(MAXMIND_LICENSE_KEY, MAXMIND_DATABASE_EDITION, MAXMIND_CACHE_DIRECTORY)
-        with maxminddb.open_database(database_path.as_posix()) as database:
-            collect_metrics(*metrics, geoip_db=database)
+        database_path = prepare_maxmind_database(CONFIG.maxmind_license_key, CONFIG.maxmind_database_edition, CONFIG.maxmind_cache_directory)
+        with open_maxmind_database(database_path) as database:
+            collect_metrics(nftables, *metrics, geoip_lookup=create_ip_country_lookup(database))
     else:
         log.info('geoip lookup disabled')
-        collect_metrics(*metrics)
+        collect_metrics(nftables, *metrics)
 
 
 def get_prometheus_metrics():
@@ -51,133 +100,174 @@ def get_prometheus_metrics():
         DictGauge(
             'chains',
             'Number of chains in nftables ruleset',
-            namespace=NAMESPACE,
+            namespace=CONFIG.namespace,
         ),
         DictGauge(
             'rules',
             'Number of rules in nftables ruleset',
-            namespace=NAMESPACE,
+            namespace=CONFIG.namespace,
         ),
         DictCounter(
             'counter_bytes',
             'Byte value of named nftables counters',
             labelnames=('family', 'table', 'name'),
-            namespace=NAMESPACE,
+            namespace=CONFIG.namespace,
             unit='bytes'
         ),
         DictCounter(
             'counter_packets',
             'Packet value of named nftables counters',
             labelnames=('family', 'table', 'name'),
-            namespace=NAMESPACE,
+            namespace=CONFIG.namespace,
             unit='packets'
         ),
         DictGauge(
             'map_elements',
             'Element count of named nftables maps',
             labelnames=('family', 'table', 'name', 'type', 'country'),
-            namespace=NAMESPACE,
+            namespace=CONFIG.namespace,
         ),
         DictGauge(
             'meter_elements',
             'Element count of named nftables meters',
             labelnames=('family', 'table', 'name', 'type', 'country'),
-            namespace=NAMESPACE,
+            namespace=CONFIG.namespace,
         ),
         DictGauge(
             'set_elements',
             'Element count of named nftables sets',
             labelnames=('family', 'table', 'name', 'type', 'country'),
-            namespace=NAMESPACE,
+            namespace=CONFIG.namespace,
         ),
     )
 
 
-def collect_metrics(chains, rules, counter_bytes, counter_packets, map_elements, meter_elements, set_elements, geoip_db=None):
+def collect_metrics(nftables, chains, rules, counter_bytes, counter_packets, map_elements, meter_elements, set_elements, geoip_lookup=None):
     """Loops forever and periodically fetches data from nftables to update prometheus metrics."""
     log.info('startup complete')
     while True:
         log.debug('collecting metrics')
-        rules.set(len(fetch_nftables('ruleset', 'rule')))
-        chains.set(len(fetch_nftables('ruleset', 'chain')))
-        for item in fetch_nftables('counters', 'counter'):
+        objects = fetch_nftables(nftables)
+        rules.set(len(objects['rule']))
+        chains.set(len(objects['chain']))
+        for item in objects['counter']:
             counter_bytes.labels(item).set(item.get('bytes', 0))
             counter_packets.labels(item).set(item.get('packets', 0))
-        map_elements.reset()
-        for item in fetch_nftables('maps', 'map'):
-            for labels, value in annotate_elements_with_country(item, geoip_db):
-                map_elements.labels(labels).set(value)
-        meter_elements.reset()
-        for item in fetch_nftables('meters', 'meter'):
-            for labels, value in annotate_elements_with_country(item, geoip_db):
-                meter_elements.labels(labels).set(value)
-        set_elements.reset()
-        for item in fetch_nftables('sets', 'set'):
-            for labels, value in annotate_elements_with_country(item, geoip_db):
-                set_elements.labels(labels).set(value)
-        time.sleep(UPDATE_PERIOD)
-
-
-def fetch_nftables(query_name, type_name):
-    """Uses nft command line tool to fetch objects from nftables."""
-    log.debug(f'fetching nftables {query_name}')
-    process = subprocess.run(
-        ('nft', '--json', 'list', query_name),
-        capture_output=True,
-        check=True,
-        text=True,
-    )
-    data = json.loads(process.stdout)
+        map_elements.update(
+            sample
+            for item in objects['map']
+            for sample in annotate_elements_with_country(item, geoip_lookup)
+        )
+        meter_elements.update(
+            sample
+            for item in objects['meter']
+            for sample in annotate_elements_with_country(item, geoip_lookup)
+        )
+        set_elements.update(
+            sample
+            for item in objects['set']
+            for sample in annotate_elements_with_country(item, geoip_lookup)
+        )
+        time.sleep(CONFIG.update_period)
+
+
+def open_nftables():
+    """Returns an in-process libnftables handle if the python bindings are available and a nft process otherwise."""
+    if libnftables:
+        try:
+            nftables = NftablesLibrary()
+            log.info('using libnftables python bindings')
+            return nftables
+        except OSError as e:
+            log.warning(f'libnftables python bindings are unusable because of {e.__class__.__name__}: {e}')
+    log.info('using nft command line tool')
+    return NftablesProcess()
+
+
+def fetch_nftables(nftables):
+    """Fetches the whole ruleset from nftables and groups its objects by type."""
+    log.debug('fetching nftables ruleset')
+    objects = group_nftables_objects(nftables.cmd('list ruleset'))
+    # meters are anonymous sets and therefore missing from the ruleset listing
+    if 'meter' not in objects:
+        log.debug('fetching nftables meters')
+        objects['meter'] = group_nftables_objects(nftables.cmd('list meters'))['meter']
+    return objects
+
+
+def group_nftables_objects(data):
+    """Groups the objects of a nftables json document by type."""
     version = data['nftables'][0]['metainfo']['json_schema_version']
     if version != 1:
         raise RuntimeError(f'nftables json schema v{version} is not supported')
-    return [
-        item[type_name]
-        for item in data['nftables'][1:]
-        if type_name in item
-    ]
+    objects = defaultdict(list)
+    for entry in data['nftables'][1:]:
+        (type_name, item), = entry.items()
+        objects[type_name].append(item)
+    return objects
 
 
-def annotate_elements_with_country(item, geoip_db):
+def annotate_elements_with_country(item, geoip_lookup):
     """Takes a nftables map, meter or set object and adds country code information to each ip address element."""
     elements = item.get('elem', ())
-    if geoip_db and item.get('type') in ('ipv4_addr', 'ipv6_addr'):
-        result = defaultdict(int)
-        for element in elements:
-            if isinstance(element, str):
-                country = lookup_ip_country(element, geoip_db)
-                result[country] += 1
-            elif isinstance(element, dict):
-                country = lookup_ip_country(element['elem']['val'], geoip_db)
-                result[country] += 1
+    if geoip_lookup and item.get('type') in ('ipv4_addr', 'ipv6_addr'):
+        try:
+            if elements and isinstance(elements[0], dict):
+                result = Counter(geoip_lookup(element['elem']['val']) for element in elements)
             else:
-                log.debug(f'got element of unexpected type {element.__class__.__name__} with {item=}')
+                result = Counter(map(geoip_lookup, elements))
+        except (KeyError, TypeError):
+            # interval sets mix plain addresses with prefixes and ranges, which may also be wrapped in elem objects
+            addresses = (get_element_address(element, item) for element in elements)
+            result = Counter(map(geoip_lookup, filter(None, addresses)))
         for country, value in result.items():
             yield dict(item, country=country), value
     else:
         yield dict(item, country=''), len(elements)
 
 
-def lookup_ip_country(address, database):
-    """Returns the country code for a given ip address."""
-    info = database.get(address)
+def get_element_address(element, item):
+    """Returns the ip address of a nftables map, meter or set element."""
+    if isinstance(element, str):
+        return element
     try:
-        return info['country']['iso_code']
-    except Exception:
-        return ''
-
-
-def retry(n=2, exceptions=Exception):
-    """A function decorator that executes the wrapped function up to n + 1 times if it throws an exception."""
+        address = element['elem']['val']
+    except (KeyError, TypeError):
+        address = None
+    if isinstance(address, str):
+        return address
+    log.debug(f'got unexpected element {element!r} with {item=}')
+    return None
+
+
+def create_ip_country_lookup(database, maxsize=100_000):
+    """Returns a cached function that maps an ip address to its country code using the given maxmind database."""
+    # misses are cached as empty string too, so private addresses don't walk the database tree on every update
+    @functools.lru_cache(maxsize=maxsize)
+    def lookup_ip_country(address):
+        info = database.get(address)
+        try:
+            return info['country']['iso_code']
+        except Exception:
+            return ''
+
+    return lookup_ip_country
+
+
+def retry(n=2, exceptions=Exception, base_delay=1.0):
+    """A function decorator that executes the wrapped function up to n + 1 times if it throws an exception and waits exponentially longer between attempts."""
     def decorator(callback):
+        @functools.wraps(callback)
         def wrapper(*args, **kwargs):
-            for _ in range(n):
+            for attempt in range(n + 1):
                 try:
                     return callback(*args, **kwargs)
                 except exceptions as e:
-                    logging.warning(f'retrying function {callback.__name__} because it raised {e.__class__.__name__}: {e}')
-                    pass
-            return callback(*args, **kwargs)
+                    if attempt == n:
+                        raise
+                    delay = base_delay * 2 ** attempt
+                    log.warning(f'retrying function {callback.__name__} in {delay:g} seconds because it raised {e.__class__.__name__}: {e}')
+                    time.sleep(delay)
 
         return wrapper
 
@@ -186,78 +276,111 @@ def retry(n=2, exceptions=Exception):
 
 def prepare_maxmind_database(license_key, database_edition, storage_dir):
     """Downloads, extracts and caches a maxmind geoip database for offline use."""
-    checksum = download_maxmind_database_checksum(license_key, database_edition)
-    archive_path = download_maxmind_database_archive(license_key, database_edition, storage_dir, checksum)
+    # both downloads go to the same host, so share one keep-alive connection between them
+    with urllib3.PoolManager(maxsize=2, headers={'User-Agent': 'nftables-exporter'}) as http:
+        checksum = download_maxmind_database_checksum(http, license_key, database_edition)
+        archive_path = download_maxmind_database_archive(http, license_key, database_edition, storage_dir, checksum)
     database_path = extract_maxmind_database_archive(database_edition, storage_dir, archive_path)
     return database_path
 
 
-@retry(exceptions=urllib.error.URLError)
-def download_maxmind_database_checksum(license_key, database_edition):
+@retry(exceptions=urllib3.exceptions.HTTPError)
+def download_maxmind_database_checksum(http, license_key, database_edition):
     """Fetches the sha256 checksum for a maxmind database."""
     checksum_url = f'https://download.maxmind.com/app/geoip_download?edition_id={database_edition}&license_key={license_key}&suffix=tar.gz.sha256'
-    with urllib.request.urlopen(checksum_url) as response:
-        words = response.readline().split(maxsplit=1)
-        checksum = words[0].decode()
+    response = http.request('GET', checksum_url)
+    check_http_response(response)
+    words = response.data.split(maxsplit=1)
+    checksum = words[0].decode()
     log.debug(f'database checksum {checksum}')
     return checksum
 
 
-@retry(exceptions=(urllib.error.URLError, RuntimeError))
-def download_maxmind_database_archive(license_key, database_edition, storage_dir, checksum):
+@retry(exceptions=(urllib3.exceptions.HTTPError, RuntimeError))
+def download_maxmind_database_archive(http, license_key, database_edition, storage_dir, checksum):
     """Downloads a maxmind database archive and validates its checksum."""
     archive_path = storage_dir/f'{database_edition}.tar.gz'
     if not archive_path.exists() or not verify_file_checksum(archive_path, checksum):
         log.info('downloading maxmind geoip database')
         database_url = f'https://download.maxmind.com/app/geoip_download?edition_id={database_edition}&license_key={license_key}&suffix=tar.gz'
-        urllib.request.urlretrieve(database_url, filename=archive_path)
+        response = http.request('GET', database_url, preload_content=False)
+        try:
+            check_http_response(response)
+            with open(archive_path, 'wb') as file:
+                shutil.copyfileobj(response, file, 1 << 20)
+        finally:
+            response.release_conn()
     if not verify_file_checksum(archive_path, checksum):
         raise RuntimeError('maxmind database checksum verification failed')
     return archive_path
 
 
+def check_http_response(response):
+    """Raises an exception if a http request was not successful."""
+    if response.status != 200:
+        raise urllib3.exceptions.HTTPError(f'got unexpected http status {response.status}')
+
+
 def extract_maxmind_database_archive(database_edition, storage_dir, archive_path):
-    """Unpacks a maxmind database archive."""
+    """Unpacks the database file from a maxmind database archive."""
     storage_dir.mkdir(exist_ok=True)
-    with tarfile.open(archive_path, 'r') as archive:
-        archive.extractall(storage_dir)
-    database_path = last(storage_dir.glob(f'{database_edition}_*/{database_edition}.mmdb'))
+    database_path = storage_dir/f'{database_edition}.mmdb'
+    temporary_path = storage_dir/f'{database_edition}.mmdb.tmp'
+    with tarfile.open(archive_path, 'r:gz') as archive:
+        member = next((member for member in archive if member.isfile() and member.name.endswith(f'/{database_edition}.mmdb')), None)
+        if not member:
+            raise RuntimeError(f'maxmind database archive does not contain {database_edition}.mmdb')
+        with archive.extractfile(member) as source, open(temporary_path, 'wb') as destination:
+            shutil.copyfileobj(source, destination, 1 << 20)
+    temporary_path.replace(database_path)
     log.info(f'maxmind database stored at {database_path}')
     return database_path
 
 
+def open_maxmind_database(database_path):
+    """Opens a maxmind database with the memory mapped c extension reader if available."""
+    try:
+        return maxminddb.open_database(database_path.as_posix(), maxminddb.MODE_MMAP_EXT)
+    except ValueError as e:
+        log.warning(f'falling back to slower maxminddb reader because the c extension is not available: {e}')
+        return maxminddb.open_database(database_path.as_posix(), maxminddb.MODE_AUTO)
+
+
 def verify_file_checksum(path, expected_checksum):
-    """Verifies the sha256 checksum of a file."""
+    """Verifies the sha256 checksum of a file and remembers the result until the file is modified."""
+    stat = path.stat()
+    verification = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': expected_checksum}
+    verification_path = path.with_name(f'{path.name}.verified')
+    try:
+        if orjson.loads(verification_path.read_bytes()) == verification:
+            log.debug(f'skipping checksum verification of unchanged file {path}')
+            return True
+    except (OSError, orjson.JSONDecodeError):
+        pass
     actual_checksum = calculate_file_checksum(path)
-    return actual_checksum == expected_checksum
+    if actual_checksum != expected_checksum:
+        return False
+    verification_path.write_bytes(orjson.dumps(verification))
+    return True
 
 
 def calculate_file_checksum(path):
     """Calculates the sha256 checksum of a file."""
-    # thanks to https://stackoverflow.com/a/3431838
-    checksum = hashlib.sha256()
     with open(path, 'rb') as file:
-        for chunk in iter(lambda: file.read(4096), b''):
-            checksum.update(chunk)
-    return checksum.hexdigest()
-
-
-def last(iterable):
-    """Returns the last element of an iterable."""
-    it = iter(iterable)
-    try:
-        while True:
-            result = next(it)
-    except StopIteration:
-        return result
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(file, 'sha256').hexdigest()
+        # fallback for python < 3.11
+        checksum = hashlib.sha256()
+        buffer = bytearray(1 << 20)
+        view = memoryview(buffer)
+        while size := file.readinto(buffer):
+            checksum.update(view[:size])
+        return checksum.hexdigest()
 
 
-def _filter_labels(data, labelnames):
-    return {
-        key: value
-        for key, value in data.items()
-        if key in labelnames
-    }
+def _label_values(data, labelnames):
+    # labelnames is small and fixed while data can be a whole nftables object, so iterate over the former
+    return tuple(str(data.get(key, '')) for key in labelnames)
 
 
 def _reset_labels(self):
@@ -268,21 +391,32 @@ def _reset_labels(self):
 
 class DictGauge(prometheus_client.Gauge):
     """Subclass of prometheus_client.Gauge with automatic label filtering."""
-    def labels(self, data):
-        return super().labels(**_filter_labels(data, self._labelnames))
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._child_values = {}
 
-    def reset(self):
-        _reset_labels(self)
+    def labels(self, data):
+        return super().labels(*_label_values(data, self._labelnames))
+
+    def update(self, samples):
+        """Sets the summed up value of each label combination in samples and removes all label combinations missing since the last update."""
+        values = Counter()
+        for data, value in samples:
+            values[_label_values(data, self._labelnames)] += value
+        for labelvalues in self._child_values.keys() - values.keys():
+            self.remove(*labelvalues)
+            del self._child_values[labelvalues]
+        for labelvalues, value in values.items():
+            # same shortcut as DictCounter.set, the value object of a child stays valid until the child is removed
+            child_value = self._child_values.get(labelvalues)
+            if child_value is None:
+                child_value = self._child_values[labelvalues] = super().labels(*labelvalues)._value
+            child_value.set(value)
 
 
 class DictCounter(prometheus_client.Counter):
     def labels(self, data):
-        filtered_data = {
-            key: value
-            for key, value in data.items()
-            if key in self._labelnames
-        }
-        return super().labels(**filtered_data)
+        return super().labels(*_label_values(data, self._labelnames))
 
     def set(self, data):
         self._value.set(data)
@@ -291,5 +425,103 @@ class DictCounter(prometheus_client.Counter):
         _reset_labels(self)
 
 
+class NftablesLibrary:
+    """Runs nft commands in-process with the libnftables python bindings."""
+    def __init__(self):
+        self._nft = libnftables.Nftables()
+        self._nft.set_json_output(True)
+
+    def cmd(self, command):
+        """Executes a nft command and returns its parsed json output."""
+        rc, output, error = self._nft.cmd(command)
+        if rc != 0:
+            raise RuntimeError(f'nft command {command!r} failed: {error.strip()}')
+        return orjson.loads(output)
+
+
+class NftablesProcess:
+    """Runs nft commands in a long-lived interactive nft process instead of spawning a new process per command."""
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self._interactive = True
+        self._interactive_succeeded = False
+        self._process = None
+
+    def cmd(self, command):
+        """Executes a nft command and returns its parsed json output."""
+        if self._interactive:
+            try:
+                data = self._interactive_cmd(command)
+                self._interactive_succeeded = True
+                return data
+            except (OSError, EOFError, TimeoutError) as e:
+                self.close()
+                if self._interactive_succeeded:
+                    log.warning(f'restarting interactive nft process because it raised {e.__class__.__name__}: {e}')
+                else:
+                    log.warning(f'falling back to one nft process per command because interactive nft raised {e.__class__.__name__}: {e}')
+                    self._interactive = False
+        process = subprocess.run(
+            ('nft', '--json', *command.split()),
+            capture_output=True,
+            check=True,
+        )
+        return orjson.loads(process.stdout)
+
+    def close(self):
+        """Terminates the interactive nft process if it is running."""
+        if self._process:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def _interactive_cmd(self, command):
+        if not self._process:
+            log.debug('starting interactive nft process')
+            self._process = subprocess.Popen(
+                ('nft', '--json', '--interactive'),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=0,
+            )
+        self._process.stdin.write(f'{command}\n'.encode())
+        return self._read_json()
+
+    def _read_json(self):
+        # each json document is printed on a single line, but depending on the line editing library a prompt may surround it
+        prompt_suffix = b'}nft> '
+        stdout, stderr = self._process.stdout, self._process.stderr
+        chunks = []
+        tail = b''
+        while True:
+            # the timeout only applies while nft stays silent, so huge rulesets may take as long as they need
+            readable, _, _ = select.select((stdout, stderr), (), (), self.timeout)
+            if not readable:
+                raise TimeoutError(f'nft did not respond within {self.timeout} seconds')
+            if stderr in readable:
+                message = os.read(stderr.fileno(), 1 << 16).decode(errors='replace').strip()
+                raise ChildProcessError(f'nft failed: {message}' if message else 'nft process exited unexpectedly')
+            chunk = os.read(stdout.fileno(), 1 << 16)
+            if not chunk:
+                raise EOFError('nft process exited unexpectedly')
+            chunks.append(chunk)
+            tail = (tail + chunk)[-len(prompt_suffix):]
+            if b'\n' not in chunk and tail != prompt_suffix:
+                continue
+            output = b''.join(chunks)
+            start = output.find(b'{')
+            if start == -1:
+                # only prompts or echoed input so far
+                chunks = []
+                continue
+            end = output.find(b'\n', start)
+            if end != -1:
+                return orjson.loads(output[start:end])
+            if output.endswith(prompt_suffix):
+                return orjson.loads(output[start:-len(prompt_suffix) + 1])
+            chunks = [output]
+
+
 if __name__ == '__main__':
     main()